@@ -1,18 +1,34 @@
 import os
 import re
+import functools
+import gzip
+import hashlib
 import json
+import logging
+import queue
+import threading
+import time
+import weakref
 from collections import deque
-from typing import Dict, List, Any, Tuple
-from datetime import datetime
+from itertools import islice
+from typing import List, Any, Tuple
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     REQUESTS_AVAILABLE = True
 except Exception:
     REQUESTS_AVAILABLE = False
 
 try:
-    from flask import Flask, request, jsonify, render_template_string
+    import orjson
+    ORJSON_AVAILABLE = True
+except Exception:
+    ORJSON_AVAILABLE = False
+
+try:
+    from flask import Flask, Response, request, jsonify, render_template_string
     FLASK_AVAILABLE = True
 except Exception:
     FLASK_AVAILABLE = False
@@ -23,6 +39,18 @@ try:
 except Exception:
     SYMPY_AVAILABLE = False
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except Exception:
+    NUMPY_AVAILABLE = False
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = NUMPY_AVAILABLE
+except Exception:
+    NUMBA_AVAILABLE = False
+
 try:
     import spacy
     SPACY_AVAILABLE = True
@@ -30,54 +58,100 @@ except Exception:
     SPACY_AVAILABLE = False
 
 
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger(__name__)
+
+_NLP = None
+if SPACY_AVAILABLE:
+    try:
+        _NLP = spacy.load("en_core_web_sm", disable=["ner", "lemmatizer"])
+    except Exception:
+        _NLP = None
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _all_binary(buf):
+        for i in range(buf.shape[0]):
+            c = buf[i]
+            if c != 48 and c != 49:
+                return False
+        return True
+
+    try:
+        _all_binary(np.frombuffer(b"01", dtype=np.uint8))
+    except Exception:
+        NUMBA_AVAILABLE = False
+
+_SUBJ_SET = frozenset({"nsubj", "nsubjpass", "csubj", "expl"})
+_VERB_SET = frozenset({"VERB", "AUX"})
+
+_AUX_VERB_RE = re.compile(r"\b(am|is|are|was|were|be|been|being|do|does|did|have|has|had|will|would|shall|should|can|could|may|might|must)\b")
+_BINARY_RE = re.compile(r"[01]+")
+_MATH_RE = re.compile(r"^[\d\+\-\*/\(\)\.\^ %]+$")
+_REGEX_STRING_RE = re.compile(r"string\s*:\s*(.*)\Z", re.IGNORECASE | re.DOTALL)
+
+
 # ===================== PERPLEXITY CLIENT =====================
 class PerplexityClient:
     def __init__(self, api_key=None):
         self.api_key = api_key or os.getenv("PERPLEXITY_API_KEY")
         self.base_url = "https://api.perplexity.ai/chat/completions"
         self.model = "sonar"
+        self._system_msg = {"role": "system",
+                            "content": "You are a chill, friendly AI. Keep it short and natural. No citations."}
+        self._base_payload = {
+            "model": self.model,
+            "temperature": 0.9,
+            "disable_search": True,
+            "return_related_sources": False,
+            "search_domain_filter": ["chat"],
+        }
+        self.session = None
+        if REQUESTS_AVAILABLE:
+            self.session = requests.Session()
+            self.session.headers.update({
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            })
+            # Connection failures only: a completion POST is not idempotent.
+            retry = Retry(total=2, backoff_factor=0.2)
+            self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=retry))
+            self._finalizer = weakref.finalize(self, self.session.close)
+
+    def close(self):
+        if self.session is not None:
+            self._finalizer()
 
     def is_available(self):
         return bool(self.api_key) and REQUESTS_AVAILABLE
 
-    def chat(self, message: str, history: List[Dict] = None, timeout: int = 30) -> str:
+    def chat(self, message: str, history: List["Turn"] = None, timeout: int = 30) -> str:
         if not self.is_available():
             return "❌ Perplexity API not available or key missing."
 
         try:
-            msgs = []
-            if history:
-                for h in history[-8:]:
-                    role = "user" if h.get("role") == "user" else "assistant"
-                    content = h.get("message", "")
-                    if content:
-                        msgs.append({"role": role, "content": content})
-            msgs.append({"role": "user", "content": message})
-
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            payload = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system",
-                     "content": "You are a chill, friendly AI. Keep it short and natural. No citations."}
-                ] + msgs,
-                "temperature": 0.9,
-                "disable_search": True,
-                "return_related_sources": False,
-                "search_domain_filter": ["chat"],
-            }
-
-
-
-            resp = requests.post(self.base_url, json=payload, headers=headers, timeout=timeout)
-            print(f"DEBUG: Perplexity status {resp.status_code}")
-            print(f"DEBUG: Response text: {resp.text[:300]}")
+            history = history or []
+            msgs = [None] * (len(history) + 1)
+            n = 0
+            for h in history:
+                role = "user" if h.role == "user" else "assistant"
+                content = h.message
+                if content:
+                    msgs[n] = {"role": role, "content": content}
+                    n += 1
+            msgs[n] = {"role": "user", "content": message}
+            del msgs[n + 1:]
+
+            payload = {**self._base_payload, "messages": [self._system_msg, *msgs]}
+            body = orjson.dumps(payload) if ORJSON_AVAILABLE else json.dumps(payload).encode()
+
+            resp = self.session.post(self.base_url, data=body, timeout=timeout)
+            log.debug("Perplexity status %s", resp.status_code)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Response text: %r", resp.content[:300])
 
             if resp.status_code == 200:
-                data = resp.json()
+                data = orjson.loads(resp.content) if ORJSON_AVAILABLE else resp.json()
                 if "choices" in data and data["choices"]:
                     return data["choices"][0]["message"]["content"]
                 else:
@@ -86,28 +160,109 @@ class PerplexityClient:
                 return f"❌ API error {resp.status_code}: {resp.text[:200]}"
 
         except Exception as e:
-            import traceback
-            print("DEBUG: Exception:", traceback.format_exc())
+            log.exception("perplexity call failed")
             return f"⚠️ Exception while calling Perplexity: {e}"
 
 
 # ===================== SPECIALIZED ENGINE =====================
-class SpecializedEngine:
-    def __init__(self):
-        self.nlp = None
-        if SPACY_AVAILABLE:
+_EXACT_INT_LIMIT = 10 ** 15
+_MEMO_MAX_LEN = 256
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_math_cached(src: str):
+    return compile(src, "<math>", "eval")
+
+
+def _compile_math(src: str):
+    src = src.lstrip(" \t")
+    if len(src) > _MEMO_MAX_LEN:
+        return compile(src, "<math>", "eval")
+    return _compile_math_cached(src)
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_user_re(p: str):
+    return re.compile(p)
+
+
+class SpacyBatcher:
+    def __init__(self, nlp, max_batch=32, max_wait=0.02, wait_timeout=1.0):
+        self.nlp = nlp
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.wait_timeout = wait_timeout
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def parse(self, text):
+        with self._lock:
+            direct = self._in_flight == 0 or not self._worker.is_alive()
+            self._in_flight += 1
+        try:
+            if not direct:
+                slot = {"event": threading.Event()}
+                self.queue.put((text, slot))
+                if slot["event"].wait(timeout=self.wait_timeout) and "doc" in slot:
+                    return slot["doc"]
+            return self.nlp(text)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _run(self):
+        while True:
+            items = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            texts = [text for text, _ in items]
             try:
-                self.nlp = spacy.load("en_core_web_sm")
+                docs = list(self.nlp.pipe(texts, batch_size=len(texts), n_process=1))
+                if len(docs) == len(items):
+                    for (_, slot), doc in zip(items, docs):
+                        slot["doc"] = doc
             except Exception:
-                self.nlp = None
+                log.exception("batched spaCy parse failed")
+            finally:
+                for _, slot in items:
+                    slot["event"].set()
+
+
+_PARSE_BATCHER = SpacyBatcher(_NLP) if _NLP is not None else None
+
+
+class SpecializedEngine:
+    def __init__(self):
+        self.nlp = _NLP
+        self.batcher = _PARSE_BATCHER
 
     def evaluate_math(self, expr):
         try:
             expr_mod = expr.replace('^', '**')
-            if SYMPY_AVAILABLE:
-                return f"Result: {sp.N(sp.sympify(expr_mod))}"
-            result = eval(expr_mod, {"__builtins__": {}})
-            return f"Result: {result}"
+            if not SYMPY_AVAILABLE or _MATH_RE.match(expr_mod):
+                try:
+                    result = eval(_compile_math(expr_mod), {"__builtins__": {}}, {})
+                except (ValueError, OverflowError, ZeroDivisionError):
+                    if not SYMPY_AVAILABLE:
+                        raise
+                else:
+                    if isinstance(result, (float, complex)):
+                        return f"Result: {result:.15g}"
+                    if isinstance(result, int) and (abs(result) < _EXACT_INT_LIMIT or not SYMPY_AVAILABLE):
+                        return f"Result: {result}"
+                    if not SYMPY_AVAILABLE:
+                        raise ValueError("expression does not evaluate to a number")
+            return f"Result: {sp.N(sp.sympify(expr_mod))}"
         except Exception as e:
             return f"Math error: {e}"
 
@@ -116,11 +271,16 @@ class SpecializedEngine:
         if not s:
             return "✗ Empty sentence."
         if self.nlp:
-            doc = self.nlp(s)
-            deps = [t.dep_.lower() for t in doc]
-            pos = [t.pos_ for t in doc]
-            has_verb = any(p == "VERB" or p == "AUX" for p in pos)
-            has_subject = any(d in ("nsubj", "nsubjpass", "csubj", "expl") for d in deps)
+            doc = self.batcher.parse(s) if self.batcher else self.nlp(s)
+            has_verb = False
+            has_subject = False
+            for t in doc:
+                if t.pos_ in _VERB_SET:
+                    has_verb = True
+                if t.dep_ in _SUBJ_SET:
+                    has_subject = True
+                if has_verb and has_subject:
+                    break
             if has_subject and has_verb:
                 return "✓ Valid English sentence."
             if has_verb:
@@ -129,34 +289,94 @@ class SpecializedEngine:
         tokens = s.split()
         if len(tokens) < 3:
             return "✗ Too short to be valid."
-        if re.search(r"\b(am|is|are|was|were|be|been|being|do|does|did|have|has|had|will|would|shall|should|can|could|may|might|must)\b", s.lower()):
+        if _AUX_VERB_RE.search(s.lower()):
             return "✓ Probably valid English sentence."
         return "✗ Seems incomplete or incorrect."
 
     def check_dfa_ends_01(self, binary):
-        if not re.fullmatch(r"[01]+", binary):
+        if NUMBA_AVAILABLE and len(binary) >= 64:
+            buf = binary.encode('ascii', 'ignore')
+            valid = len(buf) == len(binary) and _all_binary(np.frombuffer(buf, dtype=np.uint8))
+        else:
+            valid = _BINARY_RE.fullmatch(binary)
+        if not valid:
             return "Invalid input: use only 0 and 1"
         return "✓ Accepted" if binary.endswith("01") else "✗ Rejected"
 
     def check_pda_balanced(self, expr):
-        stack = []
+        if expr.count('(') != expr.count(')'):
+            return "✗ Unbalanced"
+        if NUMPY_AVAILABLE and len(expr) >= 256:
+            arr = np.frombuffer(expr.encode('ascii', 'ignore'), dtype=np.uint8)
+            delta = (arr == ord('(')).astype(np.int32) - (arr == ord(')')).astype(np.int32)
+            return "✗ Unbalanced" if np.cumsum(delta).min(initial=0) < 0 else "✓ Balanced"
+        depth = 0
         for ch in expr:
             if ch == '(':
-                stack.append(ch)
+                depth += 1
             elif ch == ')':
-                if not stack:
+                depth -= 1
+                if depth < 0:
                     return "✗ Unbalanced"
-                stack.pop()
-        return "✓ Balanced" if not stack else "✗ Unbalanced"
+        return "✓ Balanced"
 
     def test_regex(self, pattern, text):
         try:
-            return "✓ Match" if re.fullmatch(pattern, text) else "✗ No match"
+            pat = _compile_user_re(pattern)
         except re.error as e:
             return f"Regex error: {e}"
+        return "✓ Match" if pat.fullmatch(text) else "✗ No match"
+
+
+_SHARED_ENGINE = SpecializedEngine()
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_parse(sentence):
+    return _SHARED_ENGINE.parse_sentence(sentence)
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_dfa(binary):
+    return _SHARED_ENGINE.check_dfa_ends_01(binary)
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_pda(expr):
+    return _SHARED_ENGINE.check_pda_balanced(expr)
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_regex(pattern, text):
+    return _SHARED_ENGINE.test_regex(pattern, text)
+
+
+@functools.lru_cache(maxsize=512)
+def _cached_math(expr):
+    return _SHARED_ENGINE.evaluate_math(expr)
 
 
 # ===================== INTENT CLASSIFIER =====================
+def _classify_regex(tail):
+    try:
+        parts = tail.split(";")
+        pattern = parts[0].strip()
+        rest = ";".join(parts[1:])
+        m = _REGEX_STRING_RE.search(rest)
+        s = m.group(1).strip() if m else ""
+        return "regex", {"pattern": pattern, "string": s}
+    except Exception:
+        return "general", {}
+
+
+_PREFIX_INTENTS = {
+    "parse": lambda tail: ("parse", {"sentence": tail.strip()}),
+    "dfa": lambda tail: ("dfa", {"input": tail.strip()}),
+    "pda": lambda tail: ("pda", {"input": tail.strip()}),
+    "regex": _classify_regex,
+}
+
+
 class IntentClassifier:
     @staticmethod
     def classify(text):
@@ -168,39 +388,39 @@ class IntentClassifier:
             return "command", {"cmd": "clear"}
         if "daily conversation" in l or "everyday chat" in l:
             return "daily", {"message": t}
-        if l.startswith("parse:"):
-            return "parse", {"sentence": t.split(":", 1)[1].strip()}
-        if l.startswith("dfa:"):
-            return "dfa", {"input": t.split(":", 1)[1].strip()}
-        if l.startswith("pda:"):
-            return "pda", {"input": t.split(":", 1)[1].strip()}
-        if l.startswith("regex:"):
-            try:
-                tail = t.split(":", 1)[1]
-                parts = tail.split(";")
-                pattern = parts[0].strip()
-                rest = ";".join(parts[1:])
-                m = re.search(r"string\s*:\s*(.*)\Z", rest, flags=re.IGNORECASE | re.DOTALL)
-                s = m.group(1).strip() if m else ""
-                return "regex", {"pattern": pattern, "string": s}
-            except Exception:
-                return "general", {}
-        if re.match(r"^[\d\+\-\*/\(\)\.\^ %]+$", l):
+        head, sep, tail = t.partition(":")
+        if sep:
+            handler = _PREFIX_INTENTS.get(head.lower())
+            if handler:
+                return handler(tail)
+        if _MATH_RE.match(l):
             return "math", {"expression": t}
         return "general", {}
 
 
 # ===================== DIALOGUE + BOT =====================
+class Turn:
+    __slots__ = ("role", "message")
+
+    def __init__(self, role, message):
+        self.role = role
+        self.message = message
+
+
 class DialogueManager:
     def __init__(self):
         self.history = deque(maxlen=30)
 
     def add(self, role, message):
-        self.history.append({"role": role, "message": message, "timestamp": datetime.now().isoformat()})
+        self.history.append(Turn(role, message))
 
     def get_history(self):
         return list(self.history)
 
+    def recent(self, n):
+        size = len(self.history)
+        return list(islice(self.history, max(0, size - n), size))
+
     def clear(self):
         self.history.clear()
 
@@ -208,7 +428,7 @@ class DialogueManager:
 class HybridChatbot:
     def __init__(self, api_key=None):
         self.perplexity = PerplexityClient(api_key)
-        self.engine = SpecializedEngine()
+        self.engine = _SHARED_ENGINE
         self.classifier = IntentClassifier()
         self.dialogue = DialogueManager()
 
@@ -221,7 +441,7 @@ class HybridChatbot:
             return {"response": self._help_text()}
         if intent == "daily":
             if self.perplexity.is_available():
-                reply = self.perplexity.chat(params.get("message", text), self.dialogue.get_history())
+                reply = self.perplexity.chat(params.get("message", text), self.dialogue.recent(8))
                 if not reply:
                     reply = "External API didn’t respond."
             else:
@@ -230,21 +450,27 @@ class HybridChatbot:
             self.dialogue.add("assistant", reply)
             return {"response": reply}
         if intent == "parse":
-            reply = self.engine.parse_sentence(params.get("sentence", text))
+            reply = self._run_local(_cached_parse, self.engine.parse_sentence, params.get("sentence", text))
         elif intent == "dfa":
-            reply = self.engine.check_dfa_ends_01(params.get("input", text))
+            reply = self._run_local(_cached_dfa, self.engine.check_dfa_ends_01, params.get("input", text))
         elif intent == "pda":
-            reply = self.engine.check_pda_balanced(params.get("input", text))
+            reply = self._run_local(_cached_pda, self.engine.check_pda_balanced, params.get("input", text))
         elif intent == "regex":
-            reply = self.engine.test_regex(params.get("pattern", ""), params.get("string", ""))
+            reply = self._run_local(_cached_regex, self.engine.test_regex,
+                                    params.get("pattern", ""), params.get("string", ""))
         elif intent == "math":
-            reply = self.engine.evaluate_math(params.get("expression", text))
+            reply = self._run_local(_cached_math, self.engine.evaluate_math, params.get("expression", text))
         else:
             reply = self._fallback_text()
         self.dialogue.add("user", text)
         self.dialogue.add("assistant", reply)
         return {"response": reply}
 
+    def _run_local(self, cached, direct, *args):
+        if self.engine is _SHARED_ENGINE and sum(len(a) for a in args) <= _MEMO_MAX_LEN:
+            return cached(*args)
+        return direct(*args)
+
     def _help_text(self):
         return (
             "Help\n\n"
@@ -311,16 +537,36 @@ def create_web_app(api_key=None):
     b.onclick=send;i.onkeypress=e=>{if(e.key==='Enter'){send();}};
     </script></body></html>
     """
+    html_bytes = HTML_UI.encode("utf-8")
+    html_gzip = gzip.compress(html_bytes, 9)
+    html_etag = hashlib.md5(html_bytes).hexdigest()
 
     @app.route("/")
     def index():
-        return HTML_UI
+        if request.accept_encodings["gzip"]:
+            resp = Response(html_gzip, mimetype="text/html")
+            resp.headers["Content-Encoding"] = "gzip"
+            resp.set_etag(html_etag + "-gz")
+        else:
+            resp = Response(html_bytes, mimetype="text/html")
+            resp.set_etag(html_etag)
+        resp.headers["Cache-Control"] = "public, max-age=3600"
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp.make_conditional(request)
 
     @app.route("/api/chat", methods=["POST"])
     def api_chat():
-        data = request.get_json() or {}
-        text = data.get("message", "")
-        return jsonify(bot.chat(text))
+        if not ORJSON_AVAILABLE:
+            data = request.get_json(silent=True)
+            text = data.get("message", "") if isinstance(data, dict) else ""
+            return jsonify(bot.chat(text))
+        raw = request.get_data(cache=False)
+        try:
+            data = orjson.loads(raw) if raw else {}
+        except orjson.JSONDecodeError:
+            data = {}
+        text = data.get("message", "") if isinstance(data, dict) else ""
+        return Response(orjson.dumps(bot.chat(text)), mimetype="application/json")
 
     return app
 
@@ -331,5 +577,9 @@ if __name__ == "__main__":
     print("Running Hybrid Chatbot → http://localhost:5000")
     if not os.getenv("PERPLEXITY_API_KEY"):
         print("PERPLEXITY_API_KEY not set (daily conversation disabled).")
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    try:
+        from waitress import serve
+        serve(app, host="0.0.0.0", port=5000, threads=8)
+    except ImportError:
+        app.run(debug=False, host="0.0.0.0", port=5000, threaded=True)
 